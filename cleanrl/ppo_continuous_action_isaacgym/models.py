@@ -8,6 +8,107 @@ from blitz.losses.kl_divergence import kl_divergence_from_nn
 
 from custom_layers import BayesianLinear
 
+_HALF_LOG_2PI = 0.5 * math.log(2 * math.pi)
+_LOG_2 = math.log(2)
+_NORMAL_ENTROPY_OFFSET = 0.5 + _HALF_LOG_2PI
+
+
+@torch.jit.script
+def reverse_linear_scan(deltas: torch.Tensor, coeffs: torch.Tensor) -> torch.Tensor:
+    """Solves ``acc[t] = deltas[t] + coeffs[t] * acc[t + 1]`` with ``acc[T] = 0``.
+
+    Hillis-Steele scan over the time axis: log2(T) rounds of whole-tensor ops
+    instead of one round of tiny kernels per timestep. Each round writes into
+    the spare half of a pair of preallocated buffers."""
+    acc = deltas.clone()
+    coeff = coeffs.clone()
+    next_acc = torch.empty_like(acc)
+    next_coeff = torch.empty_like(coeff)
+    horizon = deltas.shape[0]
+    shift = 1
+    while shift < horizon:
+        torch.addcmul(acc[:-shift], coeff[:-shift], acc[shift:], out=next_acc[:-shift])
+        next_acc[-shift:].copy_(acc[-shift:])
+        torch.mul(coeff[:-shift], coeff[shift:], out=next_coeff[:-shift])
+        next_coeff[-shift:].copy_(coeff[-shift:])
+        acc, next_acc = next_acc, acc
+        coeff, next_coeff = next_coeff, coeff
+        shift *= 2
+    return acc
+
+
+@torch.jit.script
+def _tanh_log_det_jacobian(x: torch.Tensor) -> torch.Tensor:
+    # log(1 - tanh(x)^2) = -2 * log(cosh(x)), written in terms of |x| to stay stable
+    abs_x = x.abs()
+    return -2 * (abs_x + F.softplus(-2 * abs_x) - _LOG_2)
+
+
+@torch.jit.script
+def tanh_normal_entropy(loc: torch.Tensor, scale: torch.Tensor) -> torch.Tensor:
+    """Approximate entropy of tanh(Normal(loc, scale)), summed over actions.
+
+    The tanh correction E[log(1 - tanh(x)^2)] is evaluated at the mean rather
+    than at a sample, which keeps the estimate deterministic. That term is
+    concave in x, so this is an upper bound on the true entropy, and the gap
+    grows with ``scale``."""
+    entropy = _NORMAL_ENTROPY_OFFSET + torch.log(scale)
+    entropy = entropy + _tanh_log_det_jacobian(loc)
+    return entropy.sum(dim=-1)
+
+
+@torch.jit.script
+def tanh_normal_log_prob(
+    loc: torch.Tensor, scale: torch.Tensor, dist: torch.Tensor
+) -> torch.Tensor:
+    """Log-probability of the pre-tanh sample ``dist``, summed over actions.
+
+    Kept as one scripted elementwise chain so the fuser can emit a single pass."""
+    inv_scale = scale.reciprocal()
+    log_unnormalized = -0.5 * ((dist - loc) * inv_scale).square()
+    log_normalized = _HALF_LOG_2PI + torch.log(scale)
+    log_prob = log_unnormalized - log_normalized - _tanh_log_det_jacobian(dist)
+    return log_prob.sum(dim=-1)
+
+
+# normalize_observation and sample_normal are left as plain Python so that
+# torch.compile can trace them in compile_rollout; scripted agents compile them
+# along with the methods that call them.
+def normalize_observation(
+    observation: torch.Tensor, running_mean: torch.Tensor, inv_std: torch.Tensor
+) -> torch.Tensor:
+    return ((observation - running_mean) * inv_std).clamp_(-5, 5)
+
+
+def sample_normal(
+    loc: torch.Tensor, scale: torch.Tensor, noise: torch.Tensor
+) -> torch.Tensor:
+    """Normal(loc, scale) sample from standard normal ``noise``."""
+    return torch.addcmul(loc, scale, noise)
+
+
+@torch.jit.script
+def ppo_clip_loss(
+    target_log_probs: torch.Tensor,
+    behaviour_log_probs: torch.Tensor,
+    advantages: torch.Tensor,
+    epsilon: float,
+) -> torch.Tensor:
+    """Clipped PPO surrogate, as one scripted elementwise chain and reduction."""
+    rho_s = torch.exp(target_log_probs - behaviour_log_probs)
+    surrogate_loss1 = rho_s * advantages
+    surrogate_loss2 = rho_s.clamp(1 - epsilon, 1 + epsilon) * advantages
+    return -torch.mean(torch.minimum(surrogate_loss1, surrogate_loss2))
+
+
+def mixed_precision(device: str):
+    """bfloat16 autocast context for ``get_logits_action`` and ``loss`` calls.
+
+    Only the policy and value matmuls drop to bfloat16: the agents cast network
+    outputs back to the observation dtype, so sampling, the ratio and GAE stay
+    in full precision."""
+    return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16)
+
 
 class Agent(nn.Module):
     """Standard PPO Agent with GAE and observation normalization."""
@@ -45,6 +146,9 @@ class Agent(nn.Module):
         self.num_steps = torch.zeros((), device=device)
         self.running_mean = torch.zeros(policy_layers[0], device=device)
         self.running_variance = torch.zeros(policy_layers[0], device=device)
+        # reused by dist_sample_no_postprocess, resized on first use
+        self._noise_buf = torch.empty(0, device=device)
+        self.refresh_norm_stats()
 
         self.entropy_cost = entropy_cost
         self.discounting = discounting
@@ -53,6 +157,70 @@ class Agent(nn.Module):
         self.epsilon = clipping_val
         self.device = device
 
+    @classmethod
+    def build(cls, *args, **kwargs):
+        """Constructs the agent and compiles it, exported methods included."""
+        return torch.jit.script(cls(*args, **kwargs))
+
+    @staticmethod
+    def optimize_for_rollout(agent):
+        """``freeze_for_rollout`` followed by TorchScript's inference passes.
+
+        Always returns a frozen copy and leaves ``agent`` untouched. Like any
+        frozen copy, it has to be rebuilt after every parameter or
+        normalization update."""
+        return torch.jit.optimize_for_inference(
+            Agent.freeze_for_rollout(agent), other_methods=["get_logits_action"]
+        )
+
+    @staticmethod
+    def freeze_for_rollout(agent):
+        """Frozen TorchScript copy of ``agent`` that keeps ``get_logits_action``.
+
+        The policy weights, ``running_mean`` and the cached inverse std are all
+        inlined as constants, so re-freeze after every parameter or
+        normalization update. ``agent`` may be eager or scripted, and its own
+        training mode is left as it was."""
+        if not isinstance(agent, torch.jit.ScriptModule):
+            agent = torch.jit.script(agent)
+        was_training = agent.training
+        frozen = torch.jit.freeze(agent.eval(), preserved_attrs=["get_logits_action"])
+        agent.train(was_training)
+        return frozen
+
+    @staticmethod
+    def compile_rollout(agent):
+        """``get_logits_action`` of an eager agent, captured into CUDA graphs.
+
+        Observation shapes must stay fixed across calls. The returned logits
+        and actions are copies, so they stay valid after later calls. Agents
+        still in training mode, and PyTorch builds without ``torch.compile``,
+        get the plain method back."""
+        if agent.training or not hasattr(torch, "compile"):
+            return agent.get_logits_action
+
+        def rollout_step(observation):
+            # get_logits_action, but with fresh noise instead of a write to
+            # agent._noise_buf, which would keep the graph from being captured
+            observation = normalize_observation(
+                observation, agent.running_mean, agent._inv_std
+            )
+            logits = agent.policy(observation).to(observation.dtype)
+            loc, scale = agent.dist_create(logits)
+            action = sample_normal(loc, scale, torch.randn_like(loc))
+            return logits, action
+
+        compiled_step = torch.compile(
+            rollout_step, mode="reduce-overhead", fullgraph=True, dynamic=False
+        )
+
+        def get_logits_action(observation):
+            # outputs live in the CUDA graph pool and are overwritten on replay
+            logits, action = compiled_step(observation)
+            return logits.clone(), action.clone()
+
+        return get_logits_action
+
     @torch.jit.export
     def dist_create(self, logits):
         """Normal followed by tanh.
@@ -64,7 +232,10 @@ class Agent(nn.Module):
 
     @torch.jit.export
     def dist_sample_no_postprocess(self, loc, scale):
-        return torch.normal(loc, scale)
+        if self._noise_buf.shape != loc.shape:
+            self._noise_buf = torch.empty_like(loc)
+        self._noise_buf.normal_()
+        return sample_normal(loc, scale, self._noise_buf)
 
     @classmethod
     def dist_postprocess(cls, x):
@@ -72,112 +243,164 @@ class Agent(nn.Module):
 
     @torch.jit.export
     def dist_entropy(self, loc, scale):
-        log_normalized = 0.5 * math.log(2 * math.pi) + torch.log(scale)
-        entropy = 0.5 + log_normalized
-        entropy = entropy * torch.ones_like(loc)
-        dist = torch.normal(loc, scale)
-        log_det_jacobian = 2 * (math.log(2) - dist - F.softplus(-2 * dist))
-        entropy = entropy + log_det_jacobian
-        return entropy.sum(dim=-1)
+        return tanh_normal_entropy(loc, scale)
 
     @torch.jit.export
     def dist_log_prob(self, loc, scale, dist):
-        log_unnormalized = -0.5 * ((dist - loc) / scale).square()
-        log_normalized = 0.5 * math.log(2 * math.pi) + torch.log(scale)
-        log_det_jacobian = 2 * (math.log(2) - dist - F.softplus(-2 * dist))
-        log_prob = log_unnormalized - log_normalized - log_det_jacobian
-        return log_prob.sum(dim=-1)
+        return tanh_normal_log_prob(loc, scale, dist)
 
     @torch.jit.export
     def update_normalization(self, observation):
-        self.num_steps += observation.shape[0] * observation.shape[1]
-        input_to_old_mean = observation - self.running_mean
-        mean_diff = torch.sum(input_to_old_mean / self.num_steps, dim=(0, 1))
-        self.running_mean = self.running_mean + mean_diff
-        input_to_new_mean = observation - self.running_mean
-        var_diff = torch.sum(input_to_new_mean * input_to_old_mean, dim=(0, 1))
-        self.running_variance = self.running_variance + var_diff
+        # Chan et al. parallel merge: one pass over the batch for its mean and
+        # sum of squares, then combine with the running stats.
+        n_new = observation.shape[0] * observation.shape[1]
+        batch_mean = torch.mean(observation, dim=(0, 1))
+        batch_m2 = torch.sum((observation - batch_mean).square(), dim=(0, 1))
+        total = self.num_steps + n_new
+        delta = batch_mean - self.running_mean
+        self.running_mean = self.running_mean + delta * n_new / total
+        self.running_variance = (
+            self.running_variance
+            + batch_m2
+            + delta.square() * self.num_steps * n_new / total
+        )
+        self.num_steps = total
+        self.refresh_norm_stats()
 
     @torch.jit.export
-    def normalize(self, observation):
+    def refresh_norm_stats(self):
+        """Recomputes the cached inverse std used by ``normalize``.
+
+        Must be called whenever the running statistics are replaced."""
         variance = self.running_variance / (self.num_steps + 1.0)
-        variance = torch.clip(variance, 1e-6, 1e6)
-        return ((observation - self.running_mean) / variance.sqrt()).clip(-5, 5)
+        self._inv_std = torch.clip(variance, 1e-6, 1e6).rsqrt()
+
+    @torch.jit.export
+    def normalize(self, observation):
+        return normalize_observation(observation, self.running_mean, self._inv_std)
 
     @torch.jit.export
     def get_logits_action(self, observation):
         observation = self.normalize(observation)
-        logits = self.policy(observation)
+        # cast back from autocast, so sampling stays in the observation dtype
+        logits = self.policy(observation).to(observation.dtype)
         loc, scale = self.dist_create(logits)
         action = self.dist_sample_no_postprocess(loc, scale)
         return logits, action
 
     @torch.jit.export
-    def compute_gae(self, truncation, termination, reward, values, bootstrap_value):
-        truncation_mask = 1 - truncation
-        # Append bootstrapped value to get [v1, ..., v_t+1]
-        values_t_plus_1 = torch.cat(
-            [values[1:], torch.unsqueeze(bootstrap_value, 0)], dim=0
-        )
-        deltas = (
-            reward + self.discounting * (1 - termination) * values_t_plus_1 - values
-        )
+    def compute_gae(
+        self, truncation_mask, discount, gae_coeff, reward, values, bootstrap_value
+    ):
+        """GAE over a rollout preprocessed by ``preprocess_rollout``.
+
+        ``discount`` is discounting * (1 - termination) and ``gae_coeff`` is
+        discount * truncation_mask * lambda_."""
+        # reward + discount * v_t+1 - v_t, shifting in place rather than
+        # materializing [v1, ..., v_t+1]
+        deltas = reward - values
+        deltas[:-1].addcmul_(discount[:-1], values[1:])
+        deltas[-1].addcmul_(discount[-1], bootstrap_value)
         deltas *= truncation_mask
 
-        acc = torch.zeros_like(bootstrap_value)
-        vs_minus_v_xs = torch.zeros_like(truncation_mask)
-
-        for ti in range(truncation_mask.shape[0]):
-            ti = truncation_mask.shape[0] - ti - 1
-            acc = (
-                deltas[ti]
-                + self.discounting
-                * (1 - termination[ti])
-                * truncation_mask[ti]
-                * self.lambda_
-                * acc
-            )
-            vs_minus_v_xs[ti] = acc
+        vs_minus_v_xs = reverse_linear_scan(deltas, gae_coeff)
 
         # Add V(x_s) to get v_s.
         vs = vs_minus_v_xs + values
-        vs_t_plus_1 = torch.cat([vs[1:], torch.unsqueeze(bootstrap_value, 0)], 0)
-        advantages = (
-            reward + self.discounting * (1 - termination) * vs_t_plus_1 - values
-        ) * truncation_mask
+        # With vs_t+1 = v_t+1 + acc_t+1 (and acc = 0 past the bootstrap), the
+        # advantage (reward + discount * vs_t+1 - v_t) * mask is
+        # deltas + discount * mask * acc_t+1.
+        advantages = deltas.clone()
+        advantages[:-1].addcmul_(
+            discount[:-1] * truncation_mask[:-1], vs_minus_v_xs[1:]
+        )
         return vs, advantages
 
+    def _dual_forward(self, observation):
+        """Policy logits for ``observation[:-1]`` and values for all of it.
+
+        The first layers of both networks read the same input, so they run as
+        one matmul over their stacked weights; the bootstrap step is dropped
+        from the policy branch right after it."""
+        policy_in = self.policy[0]
+        value_in = self.value[0]
+        hidden = F.linear(
+            observation,
+            torch.cat([policy_in.weight, value_in.weight], dim=0),
+            torch.cat([policy_in.bias, value_in.bias], dim=0),
+        )
+        policy_hidden, value_hidden = torch.split(
+            hidden, [policy_in.out_features, value_in.out_features], dim=-1
+        )
+        policy_hidden = policy_hidden[:-1]
+        for i, layer in enumerate(self.policy):
+            if i > 0:
+                policy_hidden = layer(policy_hidden)
+        for i, layer in enumerate(self.value):
+            if i > 0:
+                value_hidden = layer(value_hidden)
+        return (
+            policy_hidden.to(observation.dtype),
+            value_hidden.to(observation.dtype),
+        )
+
+    @torch.jit.export
+    def preprocess_rollout(self, td: Dict[str, torch.Tensor]):
+        """Adds the policy-independent inputs of ``loss`` to a collected rollout.
+
+        Call once per rollout, before the PPO epochs that reuse it."""
+        loc, scale = self.dist_create(td["logits"])
+        td["behaviour_loc"] = loc
+        td["behaviour_scale"] = scale
+        truncation_mask = 1 - td["truncation"]
+        termination = td["done"] * truncation_mask
+        td["scaled_reward"] = td["reward"] * self.reward_scaling
+        td["trunc_mask"] = truncation_mask
+        td["discount"] = self.discounting * (1 - termination)
+        td["gae_coeff"] = td["discount"] * truncation_mask * self.lambda_
+        return td
+
     @torch.jit.export
     def loss(self, td: Dict[str, torch.Tensor]):
+        """PPO loss over a rollout that has gone through ``preprocess_rollout``.
+
+        Besides the raw rollout fields, ``td`` needs the behaviour_loc,
+        behaviour_scale, scaled_reward, trunc_mask, discount and gae_coeff
+        entries that ``preprocess_rollout`` adds."""
+        if "behaviour_loc" not in td:
+            raise RuntimeError(
+                "loss() needs a rollout passed through preprocess_rollout()"
+            )
         observation = self.normalize(td["observation"])
-        policy_logits = self.policy(observation[:-1])
-        baseline = self.value(observation)
+        policy_logits, baseline = self._dual_forward(observation)
         baseline = torch.squeeze(baseline, dim=-1)
 
         # Use last baseline value (from the value function) to bootstrap.
         bootstrap_value = baseline[-1]
         baseline = baseline[:-1]
-        reward = td["reward"] * self.reward_scaling
-        termination = td["done"] * (1 - td["truncation"])
 
-        loc, scale = self.dist_create(td["logits"])
-        behaviour_action_log_probs = self.dist_log_prob(loc, scale, td["action"])
+        behaviour_action_log_probs = self.dist_log_prob(
+            td["behaviour_loc"], td["behaviour_scale"], td["action"]
+        )
         loc, scale = self.dist_create(policy_logits)
         target_action_log_probs = self.dist_log_prob(loc, scale, td["action"])
 
         with torch.no_grad():
             vs, advantages = self.compute_gae(
-                truncation=td["truncation"],
-                termination=termination,
-                reward=reward,
+                truncation_mask=td["trunc_mask"],
+                discount=td["discount"],
+                gae_coeff=td["gae_coeff"],
+                reward=td["scaled_reward"],
                 values=baseline,
                 bootstrap_value=bootstrap_value,
             )
 
-        rho_s = torch.exp(target_action_log_probs - behaviour_action_log_probs)
-        surrogate_loss1 = rho_s * advantages
-        surrogate_loss2 = rho_s.clip(1 - self.epsilon, 1 + self.epsilon) * advantages
-        policy_loss = -torch.mean(torch.minimum(surrogate_loss1, surrogate_loss2))
+        policy_loss = ppo_clip_loss(
+            target_action_log_probs,
+            behaviour_action_log_probs,
+            advantages,
+            self.epsilon,
+        )
 
         # Value function loss
         v_error = vs - baseline
@@ -241,10 +464,25 @@ class BayesianAgent(nn.Module):
             value.append(nn.SiLU())
         value.pop()  # drop the final activation
         self.value = nn.Sequential(*value)
+        # Plain lists rather than ModuleLists so the layers are not registered
+        # (and checkpointed) a second time.
+        self._bayes_linears_policy = [
+            layer for layer in self.policy if isinstance(layer, BayesianLinear)
+        ]
+        self._bayes_linears_value = [
+            layer for layer in self.value if isinstance(layer, BayesianLinear)
+        ]
+        self._policy_widths = list(policy_layers)
+        self._value_widths = list(value_layers)
+        self._vanilla_shell = None
+        self._vanilla_shell_linears = []
 
         self.num_steps = torch.zeros((), device=device)
         self.running_mean = torch.zeros(policy_layers[0], device=device)
         self.running_variance = torch.zeros(policy_layers[0], device=device)
+        # reused by dist_sample_no_postprocess, resized on first use
+        self._noise_buf = torch.empty(0, device=device)
+        self.refresh_norm_stats()
 
         self.entropy_cost = entropy_cost
         self.discounting = discounting
@@ -265,7 +503,10 @@ class BayesianAgent(nn.Module):
 
     @torch.jit.export
     def dist_sample_no_postprocess(self, loc, scale):
-        return torch.normal(loc, scale)
+        if self._noise_buf.shape != loc.shape:
+            self._noise_buf = torch.empty_like(loc)
+        self._noise_buf.normal_()
+        return sample_normal(loc, scale, self._noise_buf)
 
     @classmethod
     def dist_postprocess(cls, x):
@@ -273,112 +514,137 @@ class BayesianAgent(nn.Module):
 
     @torch.jit.export
     def dist_entropy(self, loc, scale):
-        log_normalized = 0.5 * math.log(2 * math.pi) + torch.log(scale)
-        entropy = 0.5 + log_normalized
-        entropy = entropy * torch.ones_like(loc)
-        dist = torch.normal(loc, scale)
-        log_det_jacobian = 2 * (math.log(2) - dist - F.softplus(-2 * dist))
-        entropy = entropy + log_det_jacobian
-        return entropy.sum(dim=-1)
+        return tanh_normal_entropy(loc, scale)
 
     @torch.jit.export
     def dist_log_prob(self, loc, scale, dist):
-        log_unnormalized = -0.5 * ((dist - loc) / scale).square()
-        log_normalized = 0.5 * math.log(2 * math.pi) + torch.log(scale)
-        log_det_jacobian = 2 * (math.log(2) - dist - F.softplus(-2 * dist))
-        log_prob = log_unnormalized - log_normalized - log_det_jacobian
-        return log_prob.sum(dim=-1)
+        return tanh_normal_log_prob(loc, scale, dist)
 
     @torch.jit.export
     def update_normalization(self, observation):
-        self.num_steps += observation.shape[0] * observation.shape[1]
-        input_to_old_mean = observation - self.running_mean
-        mean_diff = torch.sum(input_to_old_mean / self.num_steps, dim=(0, 1))
-        self.running_mean = self.running_mean + mean_diff
-        input_to_new_mean = observation - self.running_mean
-        var_diff = torch.sum(input_to_new_mean * input_to_old_mean, dim=(0, 1))
-        self.running_variance = self.running_variance + var_diff
+        # Chan et al. parallel merge: one pass over the batch for its mean and
+        # sum of squares, then combine with the running stats.
+        n_new = observation.shape[0] * observation.shape[1]
+        batch_mean = torch.mean(observation, dim=(0, 1))
+        batch_m2 = torch.sum((observation - batch_mean).square(), dim=(0, 1))
+        total = self.num_steps + n_new
+        delta = batch_mean - self.running_mean
+        self.running_mean = self.running_mean + delta * n_new / total
+        self.running_variance = (
+            self.running_variance
+            + batch_m2
+            + delta.square() * self.num_steps * n_new / total
+        )
+        self.num_steps = total
+        self.refresh_norm_stats()
 
     @torch.jit.export
-    def normalize(self, observation):
+    def refresh_norm_stats(self):
+        """Recomputes the cached inverse std used by ``normalize``.
+
+        Must be called whenever the running statistics are replaced."""
         variance = self.running_variance / (self.num_steps + 1.0)
-        variance = torch.clip(variance, 1e-6, 1e6)
-        return ((observation - self.running_mean) / variance.sqrt()).clip(-5, 5)
+        self._inv_std = torch.clip(variance, 1e-6, 1e6).rsqrt()
+
+    @torch.jit.export
+    def normalize(self, observation):
+        return normalize_observation(observation, self.running_mean, self._inv_std)
 
     @torch.jit.export
     def get_logits_action(self, observation):
         observation = self.normalize(observation)
-        logits = self.policy(observation)
+        # cast back from autocast, so sampling stays in the observation dtype
+        logits = self.policy(observation).to(observation.dtype)
         loc, scale = self.dist_create(logits)
         action = self.dist_sample_no_postprocess(loc, scale)
         return logits, action
 
     @torch.jit.export
-    def compute_gae(self, truncation, termination, reward, values, bootstrap_value):
-        truncation_mask = 1 - truncation
-        # Append bootstrapped value to get [v1, ..., v_t+1]
-        values_t_plus_1 = torch.cat(
-            [values[1:], torch.unsqueeze(bootstrap_value, 0)], dim=0
-        )
-        deltas = (
-            reward + self.discounting * (1 - termination) * values_t_plus_1 - values
-        )
+    def compute_gae(
+        self, truncation_mask, discount, gae_coeff, reward, values, bootstrap_value
+    ):
+        """GAE over a rollout preprocessed by ``preprocess_rollout``.
+
+        ``discount`` is discounting * (1 - termination) and ``gae_coeff`` is
+        discount * truncation_mask * lambda_."""
+        # reward + discount * v_t+1 - v_t, shifting in place rather than
+        # materializing [v1, ..., v_t+1]
+        deltas = reward - values
+        deltas[:-1].addcmul_(discount[:-1], values[1:])
+        deltas[-1].addcmul_(discount[-1], bootstrap_value)
         deltas *= truncation_mask
 
-        acc = torch.zeros_like(bootstrap_value)
-        vs_minus_v_xs = torch.zeros_like(truncation_mask)
-
-        for ti in range(truncation_mask.shape[0]):
-            ti = truncation_mask.shape[0] - ti - 1
-            acc = (
-                deltas[ti]
-                + self.discounting
-                * (1 - termination[ti])
-                * truncation_mask[ti]
-                * self.lambda_
-                * acc
-            )
-            vs_minus_v_xs[ti] = acc
+        vs_minus_v_xs = reverse_linear_scan(deltas, gae_coeff)
 
         # Add V(x_s) to get v_s.
         vs = vs_minus_v_xs + values
-        vs_t_plus_1 = torch.cat([vs[1:], torch.unsqueeze(bootstrap_value, 0)], 0)
-        advantages = (
-            reward + self.discounting * (1 - termination) * vs_t_plus_1 - values
-        ) * truncation_mask
+        # With vs_t+1 = v_t+1 + acc_t+1 (and acc = 0 past the bootstrap), the
+        # advantage (reward + discount * vs_t+1 - v_t) * mask is
+        # deltas + discount * mask * acc_t+1.
+        advantages = deltas.clone()
+        advantages[:-1].addcmul_(
+            discount[:-1] * truncation_mask[:-1], vs_minus_v_xs[1:]
+        )
         return vs, advantages
 
+    @torch.jit.export
+    def preprocess_rollout(self, td: Dict[str, torch.Tensor]):
+        """Adds the policy-independent inputs of ``loss`` to a collected rollout.
+
+        Call once per rollout, before the PPO epochs that reuse it."""
+        loc, scale = self.dist_create(td["logits"])
+        td["behaviour_loc"] = loc
+        td["behaviour_scale"] = scale
+        truncation_mask = 1 - td["truncation"]
+        termination = td["done"] * truncation_mask
+        td["scaled_reward"] = td["reward"] * self.reward_scaling
+        td["trunc_mask"] = truncation_mask
+        td["discount"] = self.discounting * (1 - termination)
+        td["gae_coeff"] = td["discount"] * truncation_mask * self.lambda_
+        return td
+
     @torch.jit.export
     def loss(self, td: Dict[str, torch.Tensor]):
+        """PPO loss over a rollout that has gone through ``preprocess_rollout``.
+
+        Besides the raw rollout fields, ``td`` needs the behaviour_loc,
+        behaviour_scale, scaled_reward, trunc_mask, discount and gae_coeff
+        entries that ``preprocess_rollout`` adds."""
+        if "behaviour_loc" not in td:
+            raise RuntimeError(
+                "loss() needs a rollout passed through preprocess_rollout()"
+            )
         observation = self.normalize(td["observation"])
-        policy_logits = self.policy(observation[:-1])
-        baseline = self.value(observation)
+        policy_logits = self.policy(observation[:-1]).to(observation.dtype)
+        baseline = self.value(observation).to(observation.dtype)
         baseline = torch.squeeze(baseline, dim=-1)
 
         # Use last baseline value (from the value function) to bootstrap.
         bootstrap_value = baseline[-1]
         baseline = baseline[:-1]
-        reward = td["reward"] * self.reward_scaling
-        termination = td["done"] * (1 - td["truncation"])
 
-        loc, scale = self.dist_create(td["logits"])
-        behaviour_action_log_probs = self.dist_log_prob(loc, scale, td["action"])
+        behaviour_action_log_probs = self.dist_log_prob(
+            td["behaviour_loc"], td["behaviour_scale"], td["action"]
+        )
         loc, scale = self.dist_create(policy_logits)
         target_action_log_probs = self.dist_log_prob(loc, scale, td["action"])
 
         with torch.no_grad():
             vs, advantages = self.compute_gae(
-                truncation=td["truncation"],
-                termination=termination,
-                reward=reward,
+                truncation_mask=td["trunc_mask"],
+                discount=td["discount"],
+                gae_coeff=td["gae_coeff"],
+                reward=td["scaled_reward"],
                 values=baseline,
                 bootstrap_value=bootstrap_value,
             )
 
-        rho_s = torch.exp(target_action_log_probs - behaviour_action_log_probs)
-        surrogate_loss1 = rho_s * advantages
-        surrogate_loss2 = rho_s.clip(1 - self.epsilon, 1 + self.epsilon) * advantages
-        policy_loss = -torch.mean(torch.minimum(surrogate_loss1, surrogate_loss2))
+        policy_loss = ppo_clip_loss(
+            target_action_log_probs,
+            behaviour_action_log_probs,
+            advantages,
+            self.epsilon,
+        )
 
         # Value function loss
         v_error = vs - baseline
@@ -402,101 +668,60 @@ class BayesianAgent(nn.Module):
     def sample_mean_agent(
         self, clipping_val: float, learning_rate: float, entropy_cost: float
     ):
+        """Shared vanilla ``Agent`` with the posterior mean weights."""
         self.learning_rate = learning_rate
         self.entropy_cost = entropy_cost
-        policy_layers = []
-        value_layers = []
-        for a_layer in self.policy:
-            if type(a_layer) == BayesianLinear:
-                policy_layers.append(
-                    self.construct_vanilla_layer(
-                        a_layer.weight_sampler.mu[0].T, a_layer.bias_sampler.mu
-                    )
-                )
-                policy_layers.append(nn.SiLU())
-        for a_layer in self.value:
-            if type(a_layer) == BayesianLinear:
-                value_layers.append(
-                    self.construct_vanilla_layer(
-                        a_layer.weight_sampler.mu[0].T, a_layer.bias_sampler.mu
-                    )
-                )
-                value_layers.append(nn.SiLU())
-        policy_layers.pop()
-        value_layers.pop()
-        policy_layer_widths = [
-            layer.in_features for layer in policy_layers if type(layer) == nn.Linear
-        ]
-        value_layer_widths = [
-            layer.in_features for layer in value_layers if type(layer) == nn.Linear
-        ]
-        vanilla_agent = Agent(
-            clipping_val,
-            policy_layer_widths,
-            value_layer_widths,
-            self.entropy_cost,
-            self.discounting,
-            self.reward_scaling,
-            self.device,
-        )
-        vanilla_agent.policy = torch.nn.Sequential(*policy_layers)
-        vanilla_agent.value = torch.nn.Sequential(*value_layers)
-        vanilla_agent.running_mean = self.running_mean
-        vanilla_agent.running_variance = self.running_variance
-        vanilla_agent.num_steps = self.num_steps
-        return vanilla_agent
+        return self._build_vanilla_agent(clipping_val, sample=False)
 
     def sample_vanilla_agent(
         self, clipping_val: float, learning_rate: float, entropy_cost: float
     ):
+        """Shared vanilla ``Agent`` with weights drawn from the posterior."""
         self.learning_rate = learning_rate
         self.entropy_cost = entropy_cost
-        policy_layers = []
-        value_layers = []
-        for a_layer in self.policy:
-            if type(a_layer) == BayesianLinear:
-                policy_layers.append(
-                    self.construct_vanilla_layer(
-                        a_layer.weight_sampler.sample(),
-                        a_layer.bias_sampler.sample(),
-                    )
-                )
-                policy_layers.append(nn.SiLU())
-        for a_layer in self.value:
-            if type(a_layer) == BayesianLinear:
-                value_layers.append(
-                    self.construct_vanilla_layer(
-                        a_layer.weight_sampler.sample(),
-                        a_layer.bias_sampler.sample(),
-                    )
-                )
-                value_layers.append(nn.SiLU())
-        policy_layers.pop()
-        value_layers.pop()
-        policy_layer_widths = [
-            layer.in_features for layer in policy_layers if type(layer) == nn.Linear
-        ]
-        value_layer_widths = [
-            layer.in_features for layer in value_layers if type(layer) == nn.Linear
-        ]
-        vanilla_agent = Agent(
-            clipping_val,
-            policy_layer_widths,
-            value_layer_widths,
-            self.entropy_cost,
-            self.discounting,
-            self.reward_scaling,
-            self.device,
-        )
-        vanilla_agent.policy = torch.nn.Sequential(*policy_layers)
-        vanilla_agent.value = torch.nn.Sequential(*value_layers)
+        return self._build_vanilla_agent(clipping_val, sample=True)
+
+    def _build_vanilla_agent(self, clipping_val: float, sample: bool):
+        """Writes mean or sampled weights into the shared vanilla agent.
+
+        ``sample_mean_agent`` and ``sample_vanilla_agent`` both return this same
+        ``Agent`` and overwrite its weights in place on every call, so copy it
+        (e.g. with ``copy.deepcopy``) before keeping it around or handing its
+        parameters to an optimizer."""
+        if self._vanilla_shell is None:
+            shell = Agent(
+                clipping_val,
+                self._policy_widths,
+                self._value_widths,
+                self.entropy_cost,
+                self.discounting,
+                self.reward_scaling,
+                self.device,
+            ).to(self.device)
+            # Set around nn.Module.__setattr__ so the shell is not registered as
+            # a submodule, i.e. neither trained nor checkpointed with this agent.
+            object.__setattr__(self, "_vanilla_shell", shell)
+            self._vanilla_shell_linears = [
+                layer for layer in shell.policy if isinstance(layer, nn.Linear)
+            ] + [layer for layer in shell.value if isinstance(layer, nn.Linear)]
+        vanilla_agent = self._vanilla_shell
+        vanilla_agent.epsilon = clipping_val
+        vanilla_agent.entropy_cost = self.entropy_cost
+        with torch.no_grad():
+            for a_layer, vanilla_layer in zip(
+                self._bayes_linears_policy + self._bayes_linears_value,
+                self._vanilla_shell_linears,
+            ):
+                if sample:
+                    weights = a_layer.weight_sampler.sample()
+                    biases = a_layer.bias_sampler.sample()
+                else:
+                    weights = a_layer.weight_sampler.mu[0].T
+                    biases = a_layer.bias_sampler.mu
+                vanilla_layer.weight.copy_(weights)
+                vanilla_layer.bias.copy_(biases)
         vanilla_agent.running_mean = self.running_mean
         vanilla_agent.running_variance = self.running_variance
         vanilla_agent.num_steps = self.num_steps
+        vanilla_agent.refresh_norm_stats()
         return vanilla_agent
-
-    def construct_vanilla_layer(self, weights, biases):
-        layer = nn.Linear(weights.shape[1], weights.shape[0], bias=True)
-        layer.weight.data = weights
-        layer.bias.data = biases
-        return layer
\ No newline at end of file
@@ -0,0 +1,102 @@
+import os
+import sys
+
+import pytest
+import torch
+
+pytest.importorskip("blitz")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cleanrl", "ppo_continuous_action_isaacgym"))
+from models import Agent  # noqa: E402
+
+
+def make_agent(obs_dim: int, action_dim: int) -> Agent:
+    return Agent(
+        clipping_val=0.3,
+        policy_layers=[obs_dim, 32, 2 * action_dim],
+        value_layers=[obs_dim, 32, 1],
+        entropy_cost=1e-2,
+        discounting=0.97,
+        reward_scaling=0.1,
+        device="cpu",
+    )
+
+
+def test_compute_gae():
+    def compute_gae_python_loop(agent, truncation, termination, reward, values, bootstrap_value):
+        truncation_mask = 1 - truncation
+        values_t_plus_1 = torch.cat([values[1:], torch.unsqueeze(bootstrap_value, 0)], dim=0)
+        deltas = reward + agent.discounting * (1 - termination) * values_t_plus_1 - values
+        deltas *= truncation_mask
+
+        acc = torch.zeros_like(bootstrap_value)
+        vs_minus_v_xs = torch.zeros_like(truncation_mask)
+        for ti in range(truncation_mask.shape[0]):
+            ti = truncation_mask.shape[0] - ti - 1
+            acc = deltas[ti] + agent.discounting * (1 - termination[ti]) * truncation_mask[ti] * agent.lambda_ * acc
+            vs_minus_v_xs[ti] = acc
+
+        vs = vs_minus_v_xs + values
+        vs_t_plus_1 = torch.cat([vs[1:], torch.unsqueeze(bootstrap_value, 0)], 0)
+        advantages = (reward + agent.discounting * (1 - termination) * vs_t_plus_1 - values) * truncation_mask
+        return vs, advantages
+
+    torch.manual_seed(42)
+    num_steps = 123
+    num_envs = 7
+    action_dim = 3
+    agent = make_agent(obs_dim=5, action_dim=action_dim)
+    td = {
+        "logits": torch.randn(num_steps, num_envs, 2 * action_dim, dtype=torch.float64),
+        "reward": torch.rand(num_steps, num_envs, dtype=torch.float64) * 2 - 1,
+        "done": torch.randint(0, 2, (num_steps, num_envs)).double(),
+        "truncation": (torch.rand(num_steps, num_envs) < 0.2).double(),
+    }
+    values = torch.rand(num_steps, num_envs, dtype=torch.float64)
+    bootstrap_value = torch.rand(num_envs, dtype=torch.float64)
+
+    td = agent.preprocess_rollout(td)
+    vs, advantages = agent.compute_gae(
+        truncation_mask=td["trunc_mask"],
+        discount=td["discount"],
+        gae_coeff=td["gae_coeff"],
+        reward=td["scaled_reward"],
+        values=values,
+        bootstrap_value=bootstrap_value,
+    )
+    expected_vs, expected_advantages = compute_gae_python_loop(
+        agent,
+        truncation=td["truncation"],
+        termination=td["done"] * (1 - td["truncation"]),
+        reward=td["reward"] * agent.reward_scaling,
+        values=values,
+        bootstrap_value=bootstrap_value,
+    )
+    torch.testing.assert_close(vs, expected_vs)
+    torch.testing.assert_close(advantages, expected_advantages)
+
+
+def test_update_normalization():
+    def update_normalization_two_pass(num_steps, running_mean, running_variance, observation):
+        num_steps = num_steps + observation.shape[0] * observation.shape[1]
+        input_to_old_mean = observation - running_mean
+        running_mean = running_mean + torch.sum(input_to_old_mean / num_steps, dim=(0, 1))
+        input_to_new_mean = observation - running_mean
+        running_variance = running_variance + torch.sum(input_to_new_mean * input_to_old_mean, dim=(0, 1))
+        return num_steps, running_mean, running_variance
+
+    torch.manual_seed(42)
+    obs_dim = 5
+    agent = make_agent(obs_dim=obs_dim, action_dim=3)
+    num_steps = torch.zeros((), dtype=torch.float64)
+    running_mean = torch.zeros(obs_dim, dtype=torch.float64)
+    running_variance = torch.zeros(obs_dim, dtype=torch.float64)
+    for _ in range(4):
+        observation = torch.randn(17, 7, obs_dim, dtype=torch.float64) * 3 + 2
+        agent.update_normalization(observation)
+        num_steps, running_mean, running_variance = update_normalization_two_pass(
+            num_steps, running_mean, running_variance, observation
+        )
+
+    torch.testing.assert_close(agent.num_steps.double(), num_steps)
+    torch.testing.assert_close(agent.running_mean.double(), running_mean)
+    torch.testing.assert_close(agent.running_variance.double(), running_variance)
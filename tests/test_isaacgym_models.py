@@ -0,0 +1,220 @@
+import math
+import os
+import sys
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+pytest.importorskip("blitz")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "cleanrl", "ppo_continuous_action_isaacgym"))
+from custom_layers import BayesianLinear  # noqa: E402
+from models import Agent, BayesianAgent, mixed_precision, tanh_normal_entropy  # noqa: E402
+
+
+def make_agent(obs_dim: int, action_dim: int) -> Agent:
+    return Agent(
+        clipping_val=0.3,
+        policy_layers=[obs_dim, 32, 2 * action_dim],
+        value_layers=[obs_dim, 32, 1],
+        entropy_cost=1e-2,
+        discounting=0.97,
+        reward_scaling=0.1,
+        device="cpu",
+    )
+
+
+def make_rollout(agent, num_steps: int, num_envs: int, obs_dim: int):
+    observation = torch.randn(num_steps + 1, num_envs, obs_dim) * 3 + 2
+    with torch.no_grad():
+        logits, action = agent.get_logits_action(observation[:-1])
+    return {
+        "observation": observation,
+        "logits": logits,
+        "action": action,
+        "reward": torch.rand(num_steps, num_envs) * 2 - 1,
+        "done": (torch.rand(num_steps, num_envs) < 0.1).float(),
+        "truncation": (torch.rand(num_steps, num_envs) < 0.1).float(),
+    }
+
+
+def test_tanh_normal_entropy():
+    def log_det_jacobian(x):
+        return -2 * torch.log(torch.cosh(x))
+
+    def normal_entropy(scale):
+        return 0.5 + 0.5 * math.log(2 * math.pi) + torch.log(scale)
+
+    torch.manual_seed(42)
+    loc = torch.randn(4, 3, dtype=torch.float64) * 2
+    scale = torch.rand(4, 3, dtype=torch.float64) + 0.1
+
+    entropy = tanh_normal_entropy(loc, scale)
+    expected = (normal_entropy(scale) + log_det_jacobian(loc)).sum(dim=-1)
+    torch.testing.assert_close(entropy, expected)
+
+    # the exact entropy, with E[log(1 - tanh(x)^2)] taken by Gauss-Hermite quadrature
+    nodes, weights = np.polynomial.hermite_e.hermegauss(100)
+    nodes = torch.from_numpy(nodes)
+    weights = torch.from_numpy(weights / math.sqrt(2 * math.pi))
+
+    def exact_entropy(loc, scale):
+        samples = loc[..., None] + scale[..., None] * nodes
+        expected_log_det = (log_det_jacobian(samples) * weights).sum(dim=-1)
+        return (normal_entropy(scale) + expected_log_det).sum(dim=-1)
+
+    assert torch.all(entropy > exact_entropy(loc, scale))
+
+    # and the gap grows with scale
+    loc = torch.full((3,), 0.5, dtype=torch.float64)
+    gaps = []
+    for scale in [0.1, 0.5, 1.0, 2.0]:
+        scale = torch.full_like(loc, scale)
+        gaps.append((tanh_normal_entropy(loc, scale) - exact_entropy(loc, scale)).item())
+    assert gaps == sorted(gaps)
+
+
+@pytest.mark.skipif(not hasattr(torch, "compile") or sys.platform == "win32", reason="needs torch.compile")
+def test_compile_rollout(monkeypatch):
+    import torch._inductor.config
+
+    # draw the noise from the eager generator, so seeded calls match get_logits_action
+    monkeypatch.setattr(torch._inductor.config, "fallback_random", True)
+    torch.manual_seed(42)
+    agent = make_agent(obs_dim=5, action_dim=3)
+    agent.update_normalization(torch.randn(17, 7, 5) * 3 + 2)
+    agent.eval()
+    get_logits_action = Agent.compile_rollout(agent)
+
+    observation = torch.randn(7, 5) * 3 + 2
+    for seed in range(3):
+        torch.manual_seed(seed)
+        logits, action = get_logits_action(observation)
+        torch.manual_seed(seed)
+        expected_logits, expected_action = agent.get_logits_action(observation)
+        torch.testing.assert_close(logits, expected_logits)
+        torch.testing.assert_close(action, expected_action)
+
+
+def test_mixed_precision():
+    torch.manual_seed(42)
+    agent = make_agent(obs_dim=5, action_dim=3)
+    td = make_rollout(agent, num_steps=16, num_envs=7, obs_dim=5)
+    agent.update_normalization(td["observation"])
+    td = agent.preprocess_rollout(td)
+
+    with mixed_precision("cpu"):
+        assert agent.policy(td["observation"]).dtype == torch.bfloat16
+        logits, action = agent.get_logits_action(td["observation"][0])
+        losses = agent.loss(td)
+    assert logits.dtype == torch.float32
+    assert action.dtype == torch.float32
+    for loss in losses:
+        assert loss.dtype == torch.float32
+
+
+def test_scripted_agent():
+    torch.manual_seed(42)
+    scripted = Agent.build(
+        clipping_val=0.3,
+        policy_layers=[5, 32, 6],
+        value_layers=[5, 32, 1],
+        entropy_cost=1e-2,
+        discounting=0.97,
+        reward_scaling=0.1,
+        device="cpu",
+    )
+    agent = make_agent(obs_dim=5, action_dim=3)
+    agent.load_state_dict(scripted.state_dict())
+    td = make_rollout(agent, num_steps=16, num_envs=7, obs_dim=5)
+    agent.update_normalization(td["observation"])
+    scripted.update_normalization(td["observation"])
+
+    with pytest.raises(RuntimeError, match="preprocess_rollout"):
+        scripted.loss(dict(td))
+
+    expected_td = agent.preprocess_rollout(dict(td))
+    scripted_td = scripted.preprocess_rollout(dict(td))
+    assert scripted_td.keys() == expected_td.keys()
+    for key in expected_td:
+        torch.testing.assert_close(scripted_td[key], expected_td[key])
+    for loss, expected_loss in zip(scripted.loss(scripted_td), agent.loss(expected_td)):
+        torch.testing.assert_close(loss, expected_loss)
+
+    observation = td["observation"][0]
+    expected_logits, _ = agent.get_logits_action(observation)
+    for rollout_agent in [
+        Agent.freeze_for_rollout(agent),
+        Agent.freeze_for_rollout(scripted),
+        Agent.optimize_for_rollout(agent),
+    ]:
+        logits, action = rollout_agent.get_logits_action(observation)
+        torch.testing.assert_close(logits, expected_logits, rtol=1e-4, atol=1e-5)
+        assert action.shape == (7, 3)
+    assert agent.training and scripted.training
+
+
+@pytest.mark.parametrize("policy_layers", [[5, 32, 6], [5, 6]])
+def test_dual_forward(policy_layers):
+    torch.manual_seed(42)
+    agent = Agent(
+        clipping_val=0.3,
+        policy_layers=policy_layers,
+        value_layers=[5, 16, 1],
+        entropy_cost=1e-2,
+        discounting=0.97,
+        reward_scaling=0.1,
+        device="cpu",
+    )
+    td = make_rollout(agent, num_steps=16, num_envs=7, obs_dim=5)
+    agent.update_normalization(td["observation"])
+
+    observation = agent.normalize(td["observation"])
+    policy_logits, baseline = agent._dual_forward(observation)
+    torch.testing.assert_close(policy_logits, agent.policy(observation[:-1]))
+    torch.testing.assert_close(baseline, agent.value(observation))
+
+    total_loss, *_ = agent.loss(agent.preprocess_rollout(td))
+    total_loss.backward()
+    for parameter in agent.parameters():
+        assert torch.isfinite(parameter.grad).all()
+
+
+def test_sample_mean_agent():
+    torch.manual_seed(42)
+    policy_layers = [5, 16, 6]
+    value_layers = [5, 8, 1]
+    agent = BayesianAgent(
+        clipping_val=0.3,
+        number_of_cell_types=2,
+        policy_layers=policy_layers,
+        value_layers=value_layers,
+        entropy_cost=1e-2,
+        discounting=0.97,
+        reward_scaling=0.1,
+        device="cpu",
+        complexity_cost=1e-3,
+    )
+    agent.update_normalization(torch.randn(17, 7, 5) * 3 + 2)
+    mean_agent = agent.sample_mean_agent(clipping_val=0.2, learning_rate=3e-4, entropy_cost=1e-3)
+
+    for widths, bayes_net, net in [
+        (policy_layers, agent.policy, mean_agent.policy),
+        (value_layers, agent.value, mean_agent.value),
+    ]:
+        bayes_linears = [layer for layer in bayes_net if isinstance(layer, BayesianLinear)]
+        linears = [layer for layer in net if isinstance(layer, nn.Linear)]
+        assert len(linears) == len(bayes_linears) == len(widths) - 1
+        for w1, w2, bayes_linear, linear in zip(widths, widths[1:], bayes_linears, linears):
+            assert linear.weight.shape == (w2, w1)
+            assert linear.bias.shape == (w2,)
+            torch.testing.assert_close(linear.weight, bayes_linear.weight_sampler.mu[0].T)
+            torch.testing.assert_close(linear.bias, bayes_linear.bias_mu)
+    assert mean_agent.epsilon == 0.2
+    assert mean_agent.entropy_cost == 1e-3
+    torch.testing.assert_close(mean_agent.running_mean, agent.running_mean)
+    torch.testing.assert_close(mean_agent.running_variance, agent.running_variance)
+    assert not any(name.startswith("_vanilla_shell") for name in agent.state_dict())
+
+    assert agent.sample_vanilla_agent(clipping_val=0.2, learning_rate=3e-4, entropy_cost=1e-3) is mean_agent